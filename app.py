@@ -1,16 +1,24 @@
 import os
 import json
+import hashlib
+import functools
+import re
+import threading
+import httpx
+import numpy as np
 import pandas as pd
-import sqlparse
+import sqlglot
+from sqlglot import exp
 import streamlit as st
-import re
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import create_engine, event, text, inspect
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.util import LRUCache
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, OpenAIError
 from pathlib import Path
-from sqlparse.sql import Identifier, IdentifierList
-from sqlparse.tokens import Keyword, DML
+from typing import Optional
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
 # --- Page config (do this first) ---
 st.set_page_config(
@@ -19,7 +27,7 @@ st.set_page_config(
     layout="wide",
 )
 
-# --- Custom CSS to make it feel more like a website ---
+# --- Custom CSS, hero and feature cards in a single injection ---
 st.markdown(
     """
     <style>
@@ -90,7 +98,49 @@ st.markdown(
         border-radius: 0.75rem;
         overflow: hidden;
     }
+    .feature-grid {
+        display: grid;
+        grid-template-columns: repeat(3, minmax(0, 1fr));
+        gap: 1rem;
+        margin-bottom: 1rem;
+    }
+    @media (max-width: 640px) {
+        .feature-grid {
+            grid-template-columns: 1fr;
+        }
+    }
     </style>
+    <div class="pill">
+        <span>🤖</span>
+        <span>LLM-powered SQL assistant · Safe, read-only queries</span>
+    </div>
+    <div class="hero-title">Natural Language SQL Assistant</div>
+    <div class="hero-subtitle">
+        Ask questions in plain English. Get executable SQL, a data preview, and an auto-generated chart.
+    </div>
+    <div class="feature-grid">
+        <div class="feature-card">
+            <div class="feature-title">🔒 Safe by design</div>
+            <div class="feature-body">
+                Only <code>SELECT</code> and CTE queries are allowed. 
+                Mutating statements are automatically blocked.
+            </div>
+        </div>
+        <div class="feature-card">
+            <div class="feature-title">📊 Built-in visualization</div>
+            <div class="feature-body">
+                The assistant returns a Vega-Lite spec so you get 
+                charts alongside your query results.
+            </div>
+        </div>
+        <div class="feature-card">
+            <div class="feature-title">🧠 Schema-aware</div>
+            <div class="feature-body">
+                The model sees your live schema and never invents 
+                tables or columns that don't exist.
+            </div>
+        </div>
+    </div>
     """,
     unsafe_allow_html=True,
 )
@@ -102,93 +152,237 @@ if not OPENAI_API_KEY:
     st.error("Please set your OPENAI_API_KEY in a .env file or system environment variable.")
     st.stop()
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+@st.cache_resource
+def get_openai_client(api_key: str) -> OpenAI:
+    # One long-lived client across reruns so keep-alive connections are reused
+    http_client = httpx.Client(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    )
+    return OpenAI(api_key=api_key, http_client=http_client)
+
+client = get_openai_client(OPENAI_API_KEY)
+
+# --- LLM response cache settings ---
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_THRESHOLD = 0.95  # cosine similarity needed to reuse an answer
+SEMANTIC_CACHE_SIZE = 256        # answers kept per schema
+MAX_BATCH_QUESTIONS = 8          # questions answered per LLM call
+
+# --- Result size limits ---
+MAX_ROWS = 200         # LIMIT added to queries and rows shown in the preview
+MAX_CHART_ROWS = 5000  # larger results are sampled before charting
+
+# Copy-on-write makes df.head() a view (always on from pandas 3.0)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
 # --- Helper functions ---
-def is_select_only(sql: str) -> bool:
-    parsed = sqlparse.parse(sql)
-    if not parsed:
+# Quoted string literals and quoted identifiers
+_QUOTED_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+
+# Nodes that make an otherwise SELECT-shaped statement write or run arbitrary SQL
+_FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Into, exp.Create,
+    exp.Drop, exp.Alter, exp.TruncateTable, exp.Command,
+)
+
+# SQLAlchemy dialect name -> sqlglot dialect
+SQLGLOT_DIALECTS = {
+    "sqlite": "sqlite",
+    "postgresql": "postgres",
+    "mysql": "mysql",
+    "mariadb": "mysql",
+    "mssql": "tsql",
+    "oracle": "oracle",
+    "duckdb": "duckdb",
+    "snowflake": "snowflake",
+    "bigquery": "bigquery",
+}
+
+@functools.lru_cache(maxsize=512)
+def _parse_sql(sql: str, dialect: Optional[str] = None) -> Optional[tuple]:
+    # One parse per SQL string, shared by validation and normalization;
+    # callers must copy a tree before changing it
+    try:
+        return tuple(stmt for stmt in sqlglot.parse(sql, read=dialect) if stmt is not None)
+    except sqlglot.errors.SqlglotError:
+        return None
+
+@functools.lru_cache(maxsize=512)
+def is_select_only(sql: str, dialect: Optional[str] = None) -> bool:
+    """
+    Return True if every statement in the SQL is a read-only query (SELECT,
+    WITH, set operations) with no data-modifying or DDL nodes inside.
+    SQL that sqlglot cannot parse is rejected.
+    """
+    statements = _parse_sql(sql, dialect)
+    if statements is None:
         return False
-    stmt = parsed[0]
-    forbidden = {
-        "INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "TRUNCATE", "CREATE",
-        "REPLACE", "GRANT", "REVOKE", "MERGE", "CALL", "EXEC", "BEGIN", "COMMIT"
-    }
-    tokens = [t for t in stmt.flatten() if not t.is_whitespace]
-    for t in tokens:
-        if t.value.upper() in forbidden:
-            return False
-    return sql.strip().upper().startswith(("SELECT", "WITH"))
-
-def add_limit(sql: str, max_rows: int = 200) -> str:
-    upper = sql.upper()
-    if " LIMIT " in upper or " FETCH " in upper or " TOP " in upper:
-        return sql
-    return f"{sql.rstrip()} LIMIT {max_rows}"
+    return bool(statements) and all(
+        isinstance(stmt, exp.Query) and stmt.find(*_FORBIDDEN_NODES) is None
+        for stmt in statements
+    )
+
+_LIMIT_RE = re.compile(r"(?i)\b(?:LIMIT|FETCH\s+FIRST|TOP\s+\d+)\b")
+
+@functools.lru_cache(maxsize=512)
+def add_limit(sql: str, max_rows: int = MAX_ROWS) -> str:
+    return sql if _LIMIT_RE.search(sql) else f"{sql.rstrip().rstrip(';')}\nLIMIT {max_rows}"
+
+# Compiled statements shared by every connection, across reruns and sessions
+_COMPILED_CACHE = LRUCache(500)
+
+def limited_query(sql: str, max_rows: int = MAX_ROWS):
+    """
+    Build the statement that add_limit(sql) displays, with LIMIT as a bound
+    parameter so the compiled form can be reused. Colons are escaped so
+    text() does not read ':x' in the LLM's SQL as bind parameters.
+    """
+    stmt = sql.replace(":", "\\:")
+    if _LIMIT_RE.search(sql):
+        return text(stmt), {}
+    return text(f"{stmt.rstrip().rstrip(';')}\nLIMIT :max_rows"), {"max_rows": max_rows}
+
+def read_dataframe(sql: str, con, max_rows: int = MAX_ROWS) -> pd.DataFrame:
+    stmt, params = limited_query(sql, max_rows)
+    con = con.execution_options(compiled_cache=_COMPILED_CACHE)
+    # Arrow-backed columns convert to Streamlit's Arrow transport without copies
+    return pd.read_sql_query(stmt, con, params=params, dtype_backend="pyarrow")
+
+@st.cache_resource
+def _background_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="sql-assistant")
+
+def connect_in_background(engine) -> Future:
+    """Start checking out a DB connection so it is ready once the LLM responds."""
+    return _background_pool().submit(engine.connect)
+
+def rollback_connection(conn_future: Future) -> None:
+    # A failed query can leave the transaction aborted (e.g. on Postgres)
+    if conn_future.done() and conn_future.exception() is None:
+        conn_future.result().rollback()
+
+def release_connection(conn_future: Future) -> None:
+    if conn_future.exception() is None:
+        conn_future.result().close()
+
+def sanitize_chart_spec(spec) -> Optional[dict]:
+    # The chart is drawn from the query result, so drop any data the LLM embedded
+    if not isinstance(spec, dict):
+        return None
+    spec.pop("data", None)
+    spec.pop("datasets", None)
+    return spec
 
 def reflect_schema(engine) -> dict:
-    insp = inspect(engine)
-    schema = {}
-    for table in insp.get_table_names():
-        cols = [c["name"] for c in insp.get_columns(table)]
-        schema[table] = cols
-    return schema
+    return _reflect_schema(engine.url.render_as_string(hide_password=False), engine)
+
+_INFORMATION_SCHEMA_COLUMNS = """
+SELECT c.table_name, c.column_name
+FROM information_schema.columns AS c
+JOIN information_schema.tables AS t
+  ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+WHERE t.table_type = 'BASE TABLE' AND c.table_schema = {schema_fn}
+ORDER BY c.table_name, c.ordinal_position
+"""
 
+# One query returning (table, column) rows for the default schema, per dialect
+_SCHEMA_QUERIES = {
+    "sqlite": """
+    SELECT m.name, p.name
+    FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+    WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite~_%' ESCAPE '~'
+    ORDER BY m.name, p.cid
+    """,
+    "postgresql": _INFORMATION_SCHEMA_COLUMNS.format(schema_fn="current_schema()"),
+    "mysql": _INFORMATION_SCHEMA_COLUMNS.format(schema_fn="DATABASE()"),
+    "mariadb": _INFORMATION_SCHEMA_COLUMNS.format(schema_fn="DATABASE()"),
+}
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _reflect_schema(url: str, _engine) -> dict:
+    # Cached per database URL; the engine itself is not hashed.
+    query = _SCHEMA_QUERIES.get(_engine.dialect.name)
+    if query is None:
+        insp = inspect(_engine)
+        return {t: [c["name"] for c in insp.get_columns(t)] for t in insp.get_table_names()}
+
+    schema = defaultdict(list)
+    with _engine.connect() as conn:
+        for table, column in conn.exec_driver_sql(query):
+            schema[table].append(column)
+    return dict(schema)
+
+@st.cache_data(show_spinner=False)
 def schema_markdown(schema: dict) -> str:
     return "\n".join([f"- {t}({', '.join(cols)})" for t, cols in schema.items()])
 
-def normalize_table_names(sql: str, schema: dict) -> str:
+def normalize_table_names(sql: str, schema: dict, dialect: Optional[str] = None) -> str:
     """
     Normalize table names in the SQL to match the actual schema keys,
     ignoring case. Only unquoted identifiers are adjusted.
     """
     if not schema:
         return sql
+    return _normalize_table_names(sql, frozenset(schema.keys()), dialect)
+
+@functools.lru_cache(maxsize=64)
+def _table_name_pattern(table_names: frozenset) -> re.Pattern:
+    # Longest names first; skip qualified (x.name) and quoted occurrences
+    names = sorted(table_names, key=len, reverse=True)
+    alternation = "|".join(re.escape(t) for t in names)
+    return re.compile(r"(?<![.\"'\w])(" + alternation + r")(?![\w\"'])", re.I)
+
+@functools.lru_cache(maxsize=512)
+def _normalize_table_names(sql: str, table_names: frozenset, dialect: Optional[str] = None) -> str:
+    # Regenerating SQL for an unknown dialect could change its meaning
+    if dialect is None:
+        return _rename_tables_text(sql, table_names)
+    parsed = _parse_sql(sql, dialect)
+    if parsed is None:
+        return _rename_tables_text(sql, table_names)
+    statements = [tree.copy() for tree in parsed]
 
     # Map lowercase -> canonical table name from schema
-    table_map = {t.lower(): t for t in schema.keys()}
-
-    parsed = sqlparse.parse(sql)
-    if not parsed:
-        return sql
-
-    stmt = parsed[0]
-
-    def _fix_identifier(token: Identifier):
-        name = token.get_real_name()
-        if not name:
-            return
-
-        key = name.lower()
-        if key in table_map:
-            canonical = table_map[key]
-            alias = token.get_alias()
-
-            # Preserve alias, if any
-            if alias and alias != canonical:
-                token.value = f"{canonical} AS {alias}"
-            else:
-                token.value = canonical
-
-    def _recurse(tokens):
-        for token in tokens:
-            if isinstance(token, Identifier):
-                _fix_identifier(token)
-            elif isinstance(token, IdentifierList):
-                for id_token in token.get_identifiers():
-                    if isinstance(id_token, Identifier):
-                        _fix_identifier(id_token)
-            elif token.is_group:
-                _recurse(token.tokens)
-
-    _recurse(stmt.tokens)
-    return str(stmt)
-
-def ask_llm(question: str, schema: dict) -> dict:
-    sys_prompt = f"""You are a data analyst that writes safe SQL and summaries.
+    table_map = {t.lower(): t for t in table_names}
+
+    for tree in statements:
+        # CTE names shadow tables of the same name
+        ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        for table in tree.find_all(exp.Table):
+            key = table.name.lower()
+            if key in table_map and key not in ctes and not table.this.args.get("quoted"):
+                table.set("this", exp.to_identifier(table_map[key]))
+        for column in tree.find_all(exp.Column):
+            qualifier = column.args.get("table")
+            key = column.table.lower()
+            if key in table_map and key not in ctes and not qualifier.args.get("quoted"):
+                column.set("table", exp.to_identifier(table_map[key]))
+    return ";\n".join(tree.sql(dialect=dialect) for tree in statements)
+
+def _rename_tables_text(sql: str, table_names: frozenset) -> str:
+    # Regex fallback: rename occurrences outside quoted regions
+    table_map = {t.lower(): t for t in table_names}
+    pattern = _table_name_pattern(table_names)
+
+    def _canonical(match: re.Match) -> str:
+        return table_map[match.group(1).lower()]
+
+    parts, pos = [], 0
+    for quoted in _QUOTED_RE.finditer(sql):
+        parts.append(pattern.sub(_canonical, sql[pos:quoted.start()]))
+        parts.append(quoted.group())
+        pos = quoted.end()
+    parts.append(pattern.sub(_canonical, sql[pos:]))
+    return "".join(parts)
+
+def _system_prompt(schema_md: str) -> str:
+    return f"""You are a data analyst that writes safe SQL and summaries.
 
 SCHEMA:
-{schema_markdown(schema)}
+{schema_md}
 
 RULES:
 - Return valid JSON with keys: sql, summary, chart
@@ -199,44 +393,444 @@ RULES:
 - summary: short English explanation
 - chart: Vega-Lite JSON spec or null
 - Do not include comments or text outside the JSON object.
+- Respond ONLY with a JSON object.
 """
-    resp = client.chat.completions.create(
+
+_RE_LINE_CMT, _RE_BLK_CMT, _RE_TRAIL_OBJ, _RE_TRAIL_ARR = (
+    re.compile(r"//.*?\n"),
+    re.compile(r"/\*.*?\*/", re.DOTALL),
+    re.compile(r",\s*}"),
+    re.compile(r",\s*]"),
+)
+
+def _repair_json(content: str) -> str:
+    # Extract potential JSON body
+    start, end = content.find("{"), content.rfind("}")
+    fragment = content[start:end+1]
+
+    # Clean up bad formatting:
+    fragment = fragment.replace("'", '"')          # single → double quotes
+    fragment = _RE_LINE_CMT.sub("", fragment)      # remove JS-style comments
+    fragment = _RE_BLK_CMT.sub("", fragment)       # remove block comments
+    fragment = _RE_TRAIL_OBJ.sub("}", fragment)    # remove trailing commas
+    fragment = _RE_TRAIL_ARR.sub("]", fragment)
+    return fragment
+
+def _chat_request(sys_prompt: str, user_content: str) -> dict:
+    return dict(
         model="gpt-4.1-nano",
         temperature=0.2,
+        response_format={"type": "json_object"},
         messages=[
             {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": question}
+            {"role": "user", "content": user_content}
         ]
     )
 
-    content = resp.choices[0].message.content.strip()
-
-    # --- SAFER JSON PARSING ---
+def _parse_llm_json(content: str) -> dict:
     try:
         return json.loads(content)
-    except Exception:
-        # Extract potential JSON body
-        start, end = content.find("{"), content.rfind("}")
-        fragment = content[start:end+1]
-
-        # Clean up bad formatting:
-        fragment = fragment.replace("'", '"')                # single → double quotes
-        fragment = re.sub(r"//.*?\n", "", fragment)          # remove JS-style comments
-        fragment = re.sub(r"/\*.*?\*/", "", fragment)        # remove block comments
-        fragment = re.sub(r",\s*}", "}", fragment)           # remove trailing commas
-        fragment = re.sub(r",\s*]", "]", fragment)
+    except json.JSONDecodeError:
+        pass
+
+    # JSON mode should make this unreachable; keep a repair pass as insurance
+    try:
+        return json.loads(_repair_json(content))
+    except json.JSONDecodeError:
+        st.warning("⚠️ LLM returned invalid JSON. Showing raw output below:")
+        st.text(content)
+        raise
+
+def _chat_json(sys_prompt: str, user_content: str) -> dict:
+    resp = client.chat.completions.create(**_chat_request(sys_prompt, user_content))
+    return _parse_llm_json(resp.choices[0].message.content)
+
+def ask_llm(question: str, schema_md: str) -> dict:
+    llm_out = _chat_json(_system_prompt(schema_md), question)
+    if not isinstance(llm_out, dict):
+        raise ValueError(f"LLM returned {type(llm_out).__name__} instead of a JSON object.")
+    return llm_out
+
+def ask_llm_batch(questions: list, schema_md: str) -> list:
+    """
+    Answer several questions with one LLM call. JSON mode only allows an
+    object at the top level, so the answers come back wrapped in
+    {"answers": [...]}, one {sql, summary, chart} object per question.
+    Elements that are not objects come back as None.
+    """
+    sys_prompt = _system_prompt(schema_md) + (
+        '- Several questions are numbered below. Return {"answers": [...]} with one '
+        "object per question, in the same order.\n"
+    )
+    numbered = "\n".join(f"{i}) {q}" for i, q in enumerate(questions, start=1))
+    answers = _chat_json(sys_prompt, f"Answer each of the following in order:\n{numbered}").get("answers")
+    if not isinstance(answers, list) or len(answers) != len(questions):
+        raise ValueError(f"LLM returned {len(answers or [])} answers for {len(questions)} questions.")
+    return [answer if isinstance(answer, dict) else None for answer in answers]
+
+def split_questions(text_: str) -> list:
+    return [line.strip() for line in text_.splitlines() if line.strip()]
+
+# String value of a top-level field, possibly still being streamed
+_JSON_FIELD_RES = {
+    key: re.compile(r'"' + key + r'"\s*:\s*"((?:[^"\\]|\\.)*)(")?')
+    for key in ("sql", "summary")
+}
+_PARTIAL_ESCAPE_RE = re.compile(r"\\u[0-9a-fA-F]{0,3}$")
+
+def _json_string_field(buffer: str, key: str) -> tuple:
+    """
+    Decode the string value of key from a partial JSON object. Returns
+    (value, complete); value is None until something decodable arrived.
+    """
+    match = _JSON_FIELD_RES[key].search(buffer)
+    if not match:
+        return None, False
+    raw, complete = match.group(1), match.group(2) is not None
+    if not complete:
+        raw = _PARTIAL_ESCAPE_RE.sub("", raw)
+    try:
+        value = json.loads(f'"{raw}"')
+    except json.JSONDecodeError:
+        return None, False
+    if not complete and value and "\ud800" <= value[-1] <= "\udbff":
+        value = value[:-1]  # wait for the low half of a surrogate pair
+    return value, complete
+
+@st.cache_resource
+def _llm_cache() -> dict:
+    # Shared by all sessions: schema hash -> cached answers for that schema
+    return {"lock": threading.Lock(), "buckets": {}}
+
+def _cache_bucket(schema_md: str, dialect: Optional[str]) -> dict:
+    # The same tables on different databases need different SQL
+    cache = _llm_cache()
+    schema_key = hashlib.sha256(f"{dialect}\n{schema_md}".encode("utf-8")).hexdigest()
+    with cache["lock"]:
+        return cache["buckets"].setdefault(schema_key, {"exact": {}, "vectors": [], "answers": []})
+
+def _cache_key(question: str) -> str:
+    return " ".join(question.lower().split())
+
+def _embed(texts: list) -> np.ndarray:
+    resp = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    vecs = np.asarray([d.embedding for d in resp.data], dtype=np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+def lookup_cached_answers(questions: list, schema_md: str, dialect: Optional[str]) -> tuple:
+    """
+    Look questions up in the semantic cache. Exact repeats are served
+    without any API call; paraphrases are matched by embedding similarity.
+    Returns (answers, misses): answers holds a fresh dict per hit and None
+    per miss, misses maps each missed index to its embedding for
+    store_answer (None if the embeddings API was unavailable).
+    """
+    lock, bucket = _llm_cache()["lock"], _cache_bucket(schema_md, dialect)
+    keys = [_cache_key(q) for q in questions]
+
+    with lock:
+        answers = [bucket["exact"].get(key) for key in keys]
+
+    misses = {}
+    pending = [i for i, answer in enumerate(answers) if answer is None]
+    if pending:
+        try:
+            vecs = _embed([keys[i] for i in pending])
+        except OpenAIError:
+            # The cache is only an optimization; go straight to the LLM
+            return [json.loads(a) if a is not None else None for a in answers], dict.fromkeys(pending)
+        with lock:
+            sims = vecs @ np.stack(bucket["vectors"]).T if bucket["vectors"] else None
+            for row, (i, vec) in enumerate(zip(pending, vecs)):
+                best = int(np.argmax(sims[row])) if sims is not None else -1
+                if best >= 0 and sims[row][best] >= SEMANTIC_CACHE_THRESHOLD:
+                    answers[i] = bucket["answers"][best]
+                else:
+                    misses[i] = vec
+
+    return [json.loads(a) if a is not None else None for a in answers], misses
 
+def store_answer(schema_md: str, dialect: Optional[str], question: str, vec, llm_out: dict) -> None:
+    """
+    Cache an answer whose query ran successfully. Stored as a JSON string so
+    every hit decodes to a fresh dict.
+    """
+    if vec is None:
+        return
+    lock, bucket = _llm_cache()["lock"], _cache_bucket(schema_md, dialect)
+    answer = json.dumps(llm_out)
+    with lock:
+        bucket["exact"][_cache_key(question)] = answer
+        bucket["vectors"].append(vec)
+        bucket["answers"].append(answer)
+        if len(bucket["answers"]) > SEMANTIC_CACHE_SIZE:
+            del bucket["vectors"][0], bucket["answers"][0]
+            bucket["exact"].pop(next(iter(bucket["exact"])))
+
+def cached_ask_llm_batch(questions: list, schema_md: str, dialect: Optional[str]) -> tuple:
+    """
+    Answer questions through the semantic cache, sending the misses to
+    the LLM in batches of up to MAX_BATCH_QUESTIONS. Returns (answers,
+    misses) like lookup_cached_answers; fresh answers are not cached here,
+    the caller stores them once their query has run.
+    """
+    answers, misses = lookup_cached_answers(questions, schema_md, dialect)
+    missed = list(misses)
+    for start in range(0, len(missed), MAX_BATCH_QUESTIONS):
+        chunk = missed[start:start + MAX_BATCH_QUESTIONS]
+        chunk_questions = [questions[i] for i in chunk]
+        if len(chunk) == 1:
+            outs = [ask_llm(chunk_questions[0], schema_md)]
+        else:
+            outs = ask_llm_batch(chunk_questions, schema_md)
+        for i, out in zip(chunk, outs):
+            # Retry malformed batch elements on their own
+            answers[i] = out if out is not None else ask_llm(questions[i], schema_md)
+    return answers, misses
+
+def checked_sql(sql: str, schema: dict, dialect: Optional[str]) -> Optional[str]:
+    """Normalize the LLM's SQL; returns None if it is not read-only."""
+    # Renaming tables cannot make a query write, so check the original and
+    # let both steps share one parse
+    sql = sql.strip()
+    if not is_select_only(sql, dialect):
+        return None
+    return normalize_table_names(sql, schema, dialect)
+
+def render_missing_sql(schema: dict) -> None:
+    st.info("ℹ️ No SQL query was generated for this question.")
+    st.write("### Current Database Schema")
+    st.json(schema)
+
+def render_result(df: pd.DataFrame, chart) -> None:
+    # Guard the browser even if the database ignored the LIMIT
+    st.dataframe(df.head(MAX_ROWS), use_container_width=True)
+
+    chart_spec = sanitize_chart_spec(chart)
+    if chart_spec:
         try:
-            return json.loads(fragment)
+            st.subheader("📊 Visualization")
+            chart_df = df if len(df) <= MAX_CHART_ROWS else df.sample(MAX_CHART_ROWS, random_state=0)
+            st.vega_lite_chart(chart_df, chart_spec, use_container_width=True)
         except Exception as e:
-            st.warning("⚠️ LLM returned invalid JSON. Showing raw output below:")
-            st.text(content)
-            raise e
+            st.warning(f"Chart rendering failed: {e}")
+
+def render_answer(llm_out: dict, schema: dict, dialect: Optional[str], conn_future: Future) -> bool:
+    """Render one answer; returns True if its query ran."""
+    sql = llm_out.get("sql")
+    summary = llm_out.get("summary", "")
+
+    st.markdown("#### Generated SQL")
+    if not sql:
+        render_missing_sql(schema)
+        return False
+
+    sql = checked_sql(sql, schema, dialect)
+    if sql is None:
+        st.error("❌ LLM generated unsafe SQL. Query blocked.")
+        return False
+
+    st.code(add_limit(sql), language="sql")
+
+    if summary:
+        st.markdown("#### Explanation")
+        st.write(summary)
+
+    st.markdown("#### Result preview")
+    render_result(read_dataframe(sql, conn_future.result()), llm_out.get("chart"))
+    return True
+
+def stream_answer(
+    question: str, schema_md: str, schema: dict, dialect: Optional[str], conn_future: Future
+) -> tuple:
+    """
+    Stream the LLM answer for one question and render it as it arrives.
+    The summary is written token by token, and the query starts running
+    in the background as soon as the "sql" string is complete, while
+    the rest of the JSON is still being decoded. Returns (llm_out, ran)
+    where ran tells whether the query executed.
+    """
+    stream = client.chat.completions.create(
+        **_chat_request(_system_prompt(schema_md), question), stream=True
+    )
+
+    st.markdown("#### Generated SQL")
+    sql_slot = st.empty()
+    explanation_slot = st.empty()
+    state = {"buffer": "", "summary": "", "sql_seen": False, "sql": None, "df": None}
+
+    def _start_query(raw_sql) -> None:
+        state["sql_seen"] = True
+        if not raw_sql:
+            return
+        state["sql"] = checked_sql(raw_sql, schema, dialect)
+        if state["sql"] is None:
+            sql_slot.error("❌ LLM generated unsafe SQL. Query blocked.")
+            return
+        sql_slot.code(add_limit(state["sql"]), language="sql")
+        state["df"] = _background_pool().submit(read_dataframe, state["sql"], conn_future.result())
+
+    def _summary_chunks():
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            state["buffer"] += delta
+            if not state["sql_seen"]:
+                sql, complete = _json_string_field(state["buffer"], "sql")
+                if complete:
+                    _start_query(sql)
+            summary, _ = _json_string_field(state["buffer"], "summary")
+            if summary and len(summary) > len(state["summary"]):
+                yield summary[len(state["summary"]):]
+                state["summary"] = summary
+
+    try:
+        with explanation_slot.container():
+            st.markdown("#### Explanation")
+            st.write_stream(_summary_chunks())
+
+        llm_out = _parse_llm_json(state["buffer"])
+        if not state["sql_seen"]:
+            _start_query(llm_out.get("sql"))
+
+        if not llm_out.get("sql"):
+            explanation_slot.empty()
+            with sql_slot.container():
+                render_missing_sql(schema)
+            return llm_out, False
+        if state["sql"] is None:
+            explanation_slot.empty()
+            return llm_out, False
+
+        if not state["summary"]:
+            explanation_slot.empty()
+        st.markdown("#### Result preview")
+        render_result(state["df"].result(), llm_out.get("chart"))
+        return llm_out, True
+    finally:
+        # The caller closes the connection, so never leave a query running on it
+        if state["df"] is not None and not state["df"].cancel():
+            wait([state["df"]])
+
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+def create_demo_engine(db_url: str):
+    # Only for the demo DB: journal_mode=WAL is persisted in the database file
+    engine = create_engine(db_url)
+
+    # WAL lets readers run without blocking on the writer
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        for pragma in _SQLITE_PRAGMAS:
+            cur.execute(pragma)
+        cur.close()
+
+    return engine
+
+# --- Demo database ---
+DEMO_SEED_VERSION = 1  # stored in PRAGMA user_version once the demo DB is seeded
+
+DEMO_DEPARTMENTS = [
+    (1, "Engineering"),
+    (2, "Marketing"),
+    (3, "Finance"),
+]
+DEMO_EMPLOYEES = [
+    (1, "Alice", "New York", 1, 90000),
+    (2, "Bob", "Chicago", 2, 75000),
+    (3, "Charlie", "New York", 1, 80000),
+    (4, "David", "San Francisco", 1, 120000),
+    (5, "Eva", "Chicago", 2, 95000),
+]
+DEMO_PROJECTS = [
+    (101, "Product Redesign", 1, 250000),
+    (102, "Ad Campaign", 2, 100000),
+    (103, "Budget Review", 3, 50000),
+]
+
+def seed_demo_db(engine) -> None:
+    """
+    Create and populate the demo SQLite tables. Runs once per database file;
+    afterwards the seeded marker in PRAGMA user_version short-circuits it.
+    """
+    with engine.begin() as conn:
+        if conn.exec_driver_sql("PRAGMA user_version").scalar() >= DEMO_SEED_VERSION:
+            return
+
+        # --- Ensure tables exist ---
+        conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS employees(
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            city TEXT,
+            department_id INTEGER,
+            salary REAL
+        )
+        """)
+
+        conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS departments(
+            department_id INTEGER PRIMARY KEY,
+            department_name TEXT
+        )
+        """)
+
+        conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS projects(
+            project_id INTEGER PRIMARY KEY,
+            project_name TEXT,
+            department_id INTEGER,
+            budget REAL
+        )
+        """)
+
+        # --- Auto-fix employees schema if department_id is missing (from older runs) ---
+        cols = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(employees)").fetchall()]
+        if "department_id" not in cols:
+            # Drop and recreate employees with correct schema, then reseed
+            conn.exec_driver_sql("DROP TABLE employees")
+            conn.exec_driver_sql("""
+            CREATE TABLE employees(
+                id INTEGER PRIMARY KEY,
+                name TEXT,
+                city TEXT,
+                department_id INTEGER,
+                salary REAL
+            )
+            """)
+
+        # --- Seed each table independently if empty ---
+        if conn.exec_driver_sql("SELECT COUNT(*) FROM departments").scalar() == 0:
+            conn.exec_driver_sql(
+                "INSERT INTO departments(department_id, department_name) VALUES (?, ?)",
+                DEMO_DEPARTMENTS,
+            )
+        if conn.exec_driver_sql("SELECT COUNT(*) FROM employees").scalar() == 0:
+            conn.exec_driver_sql(
+                "INSERT INTO employees(id, name, city, department_id, salary) VALUES (?, ?, ?, ?, ?)",
+                DEMO_EMPLOYEES,
+            )
+        if conn.exec_driver_sql("SELECT COUNT(*) FROM projects").scalar() == 0:
+            conn.exec_driver_sql(
+                "INSERT INTO projects(project_id, project_name, department_id, budget) VALUES (?, ?, ?, ?)",
+                DEMO_PROJECTS,
+            )
+
+        conn.exec_driver_sql(f"PRAGMA user_version = {DEMO_SEED_VERSION}")
 
 # --- Session state for DB ---
 if "engine" not in st.session_state:
     st.session_state.engine = None
     st.session_state.schema = None
+    st.session_state.schema_md = ""
+    st.session_state.dialect = None
     st.session_state.connected = False
 
 # --- SIDEBAR: Connection panel ---
@@ -256,88 +850,23 @@ with st.sidebar:
             if not db_url:
                 db_path = Path("demo.sqlite")
                 if reset_demo and db_path.exists():
-                    db_path.unlink()  # delete old demo DB
+                    if st.session_state.engine is not None:
+                        st.session_state.engine.dispose()
+                    # delete old demo DB along with its WAL files
+                    for path in (db_path, Path(f"{db_path}-wal"), Path(f"{db_path}-shm")):
+                        path.unlink(missing_ok=True)
 
                 db_url = f"sqlite:///{db_path}"
-                engine = create_engine(db_url)
+                engine = create_demo_engine(db_url)
 
-                with engine.begin() as conn:
-                    # --- Ensure tables exist ---
-                    conn.exec_driver_sql("""
-                    CREATE TABLE IF NOT EXISTS employees(
-                        id INTEGER PRIMARY KEY,
-                        name TEXT,
-                        city TEXT,
-                        department_id INTEGER,
-                        salary REAL
-                    )
-                    """)
-
-                    conn.exec_driver_sql("""
-                    CREATE TABLE IF NOT EXISTS departments(
-                        department_id INTEGER PRIMARY KEY,
-                        department_name TEXT
-                    )
-                    """)
-
-                    conn.exec_driver_sql("""
-                    CREATE TABLE IF NOT EXISTS projects(
-                        project_id INTEGER PRIMARY KEY,
-                        project_name TEXT,
-                        department_id INTEGER,
-                        budget REAL
-                    )
-                    """)
-
-                    # --- Auto-fix employees schema if department_id is missing (from older runs) ---
-                    cols = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(employees)").fetchall()]
-                    if "department_id" not in cols:
-                        # Drop and recreate employees with correct schema, then reseed
-                        conn.exec_driver_sql("DROP TABLE employees")
-                        conn.exec_driver_sql("""
-                        CREATE TABLE employees(
-                            id INTEGER PRIMARY KEY,
-                            name TEXT,
-                            city TEXT,
-                            department_id INTEGER,
-                            salary REAL
-                        )
-                        """)
-
-                    # --- Seed each table independently if empty ---
-                    dep_count = conn.exec_driver_sql("SELECT COUNT(*) FROM departments").scalar()
-                    if dep_count == 0:
-                        conn.exec_driver_sql("""
-                        INSERT INTO departments(department_id, department_name) VALUES
-                            (1, 'Engineering'),
-                            (2, 'Marketing'),
-                            (3, 'Finance');
-                        """)
-
-                    emp_count = conn.exec_driver_sql("SELECT COUNT(*) FROM employees").scalar()
-                    if emp_count == 0:
-                        conn.exec_driver_sql("""
-                        INSERT INTO employees(id, name, city, department_id, salary) VALUES
-                            (1, 'Alice', 'New York', 1, 90000),
-                            (2, 'Bob', 'Chicago', 2, 75000),
-                            (3, 'Charlie', 'New York', 1, 80000),
-                            (4, 'David', 'San Francisco', 1, 120000),
-                            (5, 'Eva', 'Chicago', 2, 95000);
-                        """)
-
-                    proj_count = conn.exec_driver_sql("SELECT COUNT(*) FROM projects").scalar()
-                    if proj_count == 0:
-                        conn.exec_driver_sql("""
-                        INSERT INTO projects(project_id, project_name, department_id, budget) VALUES
-                            (101, 'Product Redesign', 1, 250000),
-                            (102, 'Ad Campaign', 2, 100000),
-                            (103, 'Budget Review', 3, 50000);
-                        """)
+                seed_demo_db(engine)
             else:
                 engine = create_engine(db_url)
 
             st.session_state.engine = engine
             st.session_state.schema = reflect_schema(engine)
+            st.session_state.schema_md = schema_markdown(st.session_state.schema)
+            st.session_state.dialect = SQLGLOT_DIALECTS.get(engine.dialect.name)
             st.session_state.connected = True
             st.success("Connected ✅")
             st.caption(f"Tables: {', '.join(st.session_state.schema.keys()) or 'None'}")
@@ -354,65 +883,6 @@ with st.sidebar:
     st.markdown("---")
     st.caption("Tip: Leave URL empty to use the demo SQLite database with sample HR data.")
 
-# --- MAIN: Hero section ---
-st.markdown(
-    """
-    <div class="pill">
-        <span>🤖</span>
-        <span>LLM-powered SQL assistant · Safe, read-only queries</span>
-    </div>
-    <div class="hero-title">Natural Language SQL Assistant</div>
-    <div class="hero-subtitle">
-        Ask questions in plain English. Get executable SQL, a data preview, and an auto-generated chart.
-    </div>
-    """,
-    unsafe_allow_html=True,
-)
-
-# --- Feature cards ---
-col1, col2, col3 = st.columns(3)
-with col1:
-    st.markdown(
-        """
-        <div class="feature-card">
-            <div class="feature-title">🔒 Safe by design</div>
-            <div class="feature-body">
-                Only <code>SELECT</code> and CTE queries are allowed. 
-                Mutating statements are automatically blocked.
-            </div>
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
-with col2:
-    st.markdown(
-        """
-        <div class="feature-card">
-            <div class="feature-title">📊 Built-in visualization</div>
-            <div class="feature-body">
-                The assistant returns a Vega-Lite spec so you get 
-                charts alongside your query results.
-            </div>
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
-with col3:
-    st.markdown(
-        """
-        <div class="feature-card">
-            <div class="feature-title">🧠 Schema-aware</div>
-            <div class="feature-body">
-                The model sees your live schema and never invents 
-                tables or columns that don't exist.
-            </div>
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
-
-st.markdown("")
-
 # --- Tabs for interaction ---
 if st.session_state.engine:
     tab_query, tab_schema = st.tabs(["💬 Ask a question", "📚 Schema & examples"])
@@ -438,48 +908,37 @@ if st.session_state.engine:
             run_clicked = st.button("🚀 Run", use_container_width=True)
 
         if run_clicked and question.strip():
+            conn_future = connect_in_background(st.session_state.engine)
             try:
-                llm_out = ask_llm(question, st.session_state.schema)
-                sql = llm_out.get("sql")
-                summary = llm_out.get("summary", "")
-
-                st.markdown("#### Generated SQL")
-                if not sql:
-                    st.info("ℹ️ No SQL query was generated for this question.")
-                    st.write("### Current Database Schema")
-                    st.json(st.session_state.schema)
+                questions = split_questions(question)
+                schema_md, dialect = st.session_state.schema_md, st.session_state.dialect
+                if len(questions) == 1:
+                    llm_outs, misses = lookup_cached_answers(questions, schema_md, dialect)
+                else:
+                    llm_outs, misses = cached_ask_llm_batch(questions, schema_md, dialect)
+
+                if len(questions) == 1 and misses:
+                    # Nothing cached: stream the answer instead of waiting for all of it
+                    llm_out, ran = stream_answer(
+                        questions[0], schema_md, st.session_state.schema, dialect, conn_future
+                    )
+                    if ran:
+                        store_answer(schema_md, dialect, questions[0], misses[0], llm_out)
                 else:
-                    sql = sql.strip()
-                    sql = normalize_table_names(sql, st.session_state.schema)
-
-                    if not is_select_only(sql):
-                        st.error("❌ LLM generated unsafe SQL. Query blocked.")
-                    else:
-                        sql = add_limit(sql)
-                        st.code(sql, language="sql")
-
-                        if summary:
-                            st.markdown("#### Explanation")
-                            st.write(summary)
-
-                        st.markdown("#### Result preview")
-                        df = pd.read_sql_query(sql, st.session_state.engine)
-                        st.dataframe(df, use_container_width=True)
-
-                        chart_spec = llm_out.get("chart")
-                        if chart_spec:
-                            try:
-                                if isinstance(chart_spec, str):
-                                    chart_spec = json.loads(chart_spec)
-                                # Remove external data reference if present
-                                if "data" in chart_spec:
-                                    del chart_spec["data"]
-                                st.subheader("📊 Visualization")
-                                st.vega_lite_chart(df, chart_spec, use_container_width=True)
-                            except Exception as e:
-                                st.warning(f"Chart rendering failed: {e}")
+                    for i, (q, llm_out) in enumerate(zip(questions, llm_outs)):
+                        if len(questions) > 1:
+                            st.markdown(f"### {q}")
+                        try:
+                            ran = render_answer(llm_out, st.session_state.schema, dialect, conn_future)
+                            if ran and i in misses:
+                                store_answer(schema_md, dialect, q, misses[i], llm_out)
+                        except Exception as e:
+                            st.error(f"Error: {e}")
+                            rollback_connection(conn_future)
             except Exception as e:
                 st.error(f"Error: {e}")
+            finally:
+                release_connection(conn_future)
         elif run_clicked and not question.strip():
             st.warning("Please type a question before running.")
 